@@ -1,46 +1,205 @@
 import streamlit as st
-import requests
-import json
+import asyncio
+import httpx
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential
+import orjson
+import msgspec
 from bs4 import BeautifulSoup
-import pandas as pd
-from typing import List, Dict
+import pyarrow as pa
+from typing import Callable, List, Dict, Iterator, Optional, Tuple, Union
+import logging
 import os
 import re
+import time
+from urllib.parse import urlsplit, urlunsplit
+from llm_cache import ResponseCache, SemanticCache, cache_key
+
+logger = logging.getLogger(__name__)
+
+# Linear-time re2 matching for long model outputs, when available
+try:
+    import re2
+    _URL_RE = re2.compile(r'https?://[^\s"]+')
+except ImportError:
+    _URL_RE = re.compile(r'https?://[^\s"]+')
 
 # Set page config
 st.set_page_config(page_title="Amazon Book Analyzer", layout="wide")
 
+# Load the semantic response cache once per server process
+@st.cache_resource(show_spinner=False)
+def get_semantic_cache():
+    if not st.secrets.get("SEMANTIC_CACHE_ENABLED", True):
+        return None
+    try:
+        from sentence_transformers import SentenceTransformer
+        
+        encoder = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2", backend="onnx")
+        return SemanticCache(
+            st.secrets.get("SEMANTIC_CACHE_PATH", ".cache/llm_cache"),
+            encoder,
+            threshold=float(st.secrets.get("SEMANTIC_CACHE_THRESHOLD", 0.92)),
+            ttl=int(st.secrets.get("SEMANTIC_CACHE_TTL", 7 * 24 * 3600)),
+        )
+    except Exception:
+        # The cache is only an optimization; run without it if the encoder
+        # can't be downloaded or loaded, or the index on disk is unreadable
+        logger.warning("Semantic cache disabled", exc_info=True)
+        return None
+
+# Load the exact-match response cache, backed by Redis when configured
+@st.cache_resource(show_spinner=False)
+def get_response_cache():
+    ttl = int(st.secrets.get("RESPONSE_CACHE_TTL", 3600))
+    redis_url = st.secrets.get("REDIS_URL")
+    if redis_url:
+        try:
+            import redis
+            return ResponseCache(
+                # Short timeouts so a slow Redis degrades to a cache miss quickly
+                redis.Redis.from_url(redis_url, socket_timeout=0.5, socket_connect_timeout=0.5),
+                ttl=ttl,
+            )
+        except Exception:
+            # Fall back to the in-memory cache if redis is missing or REDIS_URL is invalid
+            logger.warning("Redis response cache disabled", exc_info=True)
+    return ResponseCache(ttl=ttl)
+
+# Keep one HTTP/2 client per server process so streamed requests reuse the
+# TCP+TLS connection to OpenRouter across calls and Streamlit reruns
+@st.cache_resource(show_spinner=False)
+def _get_session() -> httpx.Client:
+    return httpx.Client(http2=True, timeout=60, headers={"Content-Type": "application/json"})
+
+DEFAULT_MODEL = "google/gemini-2.0-flash-001"
+# Listing URLs is an easy task, so search uses a small model by default and
+# the larger model is kept for the recommendations
+SEARCH_MODEL = "meta-llama/llama-3.2-3b-instruct"
+RECOMMENDATIONS_MODEL = DEFAULT_MODEL
+OPENROUTER_API_URL = "https://openrouter.ai/api/v1"
+_URL = f"{OPENROUTER_API_URL}/chat/completions"
+
+# Read the API key and build the auth headers once instead of on every request.
+# Without a key the headers are still defined; requests then fail with a 401.
+_API_KEY = st.secrets["OPENROUTER_API_KEY"] if "OPENROUTER_API_KEY" in st.secrets else None
+_AUTH_HEADERS = {"Authorization": f"Bearer {_API_KEY}"} if _API_KEY else {}
+_HEADERS = {"Content-Type": "application/json", **_AUTH_HEADERS}
+BATCH_POLL_INTERVAL = 10
+BATCH_MAX_WAIT = 15 * 60
+MAX_CONCURRENT_REQUESTS = 10
+
+# Retry rate limiting and transient server errors, not client errors
+def _is_retryable(error: BaseException) -> bool:
+    return isinstance(error, httpx.HTTPStatusError) and (
+        error.response.status_code == 429 or error.response.status_code >= 500
+    )
+
+# Send a single chat completion request to OpenRouter
+@retry(wait=wait_exponential(), stop=stop_after_attempt(3), retry=retry_if_exception(_is_retryable), reraise=True)
+async def _call_openrouter(client: httpx.AsyncClient, payload: Dict) -> str:
+    response = await client.post(_URL, headers=_HEADERS, content=orjson.dumps(payload))
+    response.raise_for_status()
+    return orjson.loads(response.content)["choices"][0]["message"]["content"]
+
+# Static instructions are sent first as a system message and the dynamic input
+# last, so providers can cache the shared prompt prefix across calls
+SEARCH_PROMPT = """You are an Amazon book search assistant. Search Amazon for books related to the topic given by the user. Return a JSON list of up to 10 book URLs in this exact format:
+["url1", "url2", ...].
+Only include books, no other product types. Ensure the response is valid JSON. If no books are found, return an empty JSON list []."""
+
+BOOK_DATA_PROMPT = """You are an Amazon book metadata and review extractor. For the Amazon book URLs given by the user, get detailed information including price, description, author, publisher, and ISBN, and retrieve detailed customer reviews and ratings.
+Return JSON in this exact format:
+{"details": [{"url": ..., "price": ..., "description": ..., "author": ..., "publisher": ..., "isbn": ...}], "reviews": [{"url": ..., "review_text": ..., "rating": ...}]}
+Use strings for url, description, author, publisher, and isbn, and a number or string for price and rating. Use null for unknown values.
+Support up to 50 book URLs. Only process URLs that correspond to books."""
+
+RETRY_PROMPT = """Your previous response did not match the requested JSON format: {error}
+Return only valid JSON in the requested format."""
+
+RECOMMENDATIONS_PROMPT = """Based on the book data given by the user, generate recommendations for book title, features (like genre, length, or target audience), and price."""
+
+# Expected shape of a BOOK_DATA_PROMPT response. Models don't always follow the
+# requested types: prices, ratings and ISBNs come back as numbers or strings,
+# and multiple authors as a list.
+class BookDetail(msgspec.Struct):
+    url: str
+    price: Optional[Union[str, float]] = None
+    description: Optional[str] = None
+    author: Optional[Union[str, List[str]]] = None
+    publisher: Optional[str] = None
+    isbn: Optional[Union[str, int]] = None
+
+class Review(msgspec.Struct):
+    url: str
+    review_text: Optional[str] = None
+    rating: Optional[Union[str, float]] = None
+
+class BookData(msgspec.Struct):
+    details: List[BookDetail] = []
+    reviews: List[Review] = []
+
+# Build chat messages, marking the static system prompt as a cache breakpoint.
+# followup carries later turns, e.g. a previous reply and a correction request.
+def build_messages(system: str, prompt: str, followup: Optional[List[Dict]] = None) -> List[Dict]:
+    return [
+        {
+            "role": "system",
+            "content": [{"type": "text", "text": system, "cache_control": {"type": "ephemeral"}}]
+        },
+        {"role": "user", "content": prompt},
+        *(followup or [])
+    ]
+
 # Function to get OpenRouter response with Gemini model
-def get_openrouter_response(prompt: str) -> str:
-    api_key = st.secrets["OPENROUTER_API_KEY"]
-    url = "https://openrouter.ai/api/v1/chat/completions"
+# Semantic matching is only used for prompts whose dynamic part is the user's
+# topic; prompts that carry URL lists or book data only reuse exact matches.
+# When validate is given, only responses it accepts are written to the caches.
+async def get_openrouter_response(client: httpx.AsyncClient, system: str, prompt: str, model: str = DEFAULT_MODEL, semantic: bool = False, validate: Optional[Callable[[str], bool]] = None, followup: Optional[List[Dict]] = None) -> str:
+    # Greedy decoding keeps responses reproducible, which the caches rely on
+    payload = {"model": model, "messages": build_messages(system, prompt, followup), "temperature": 0}
     
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {api_key}"
-    }
+    response_cache = get_response_cache()
+    semantic_cache = get_semantic_cache() if semantic else None
+    key = cache_key(model, system + prompt + (orjson.dumps(followup).decode() if followup else ""))
     
-    payload = {
-        "model": "google/gemini-2.0-flash-001",  # Updated to requested model
-        "messages": [{"role": "user", "content": prompt}]
-    }
+    # ResponseCache calls are blocking (Redis I/O), so run them off the event
+    # loop to keep a slow Redis from serializing concurrent requests
+    if response_cache:
+        cached = await asyncio.to_thread(response_cache.get, key)
+        if cached is not None:
+            return cached
+    if semantic_cache:
+        cached = semantic_cache.get(prompt, namespace=model)
+        if cached is not None:
+            return cached
     
     try:
-        response = requests.post(url, headers=headers, json=payload)
-        response.raise_for_status()
-        return response.json()["choices"][0]["message"]["content"]
+        content = await _call_openrouter(client, payload)
     except Exception as e:
         st.error(f"Error connecting to OpenRouter: {str(e)}")
         return None
+    
+    if content and (validate is None or validate(content)):
+        if response_cache:
+            await asyncio.to_thread(response_cache.put, key, content)
+        if semantic_cache:
+            semantic_cache.put(prompt, content, namespace=model)
+    return content
+
+# Check that a search reply yields at least one URL, so empty or unusable
+# replies are not cached
+def _has_book_urls(response: str) -> bool:
+    try:
+        parsed_urls = orjson.loads(response)
+    except orjson.JSONDecodeError:
+        return _URL_RE.search(response) is not None
+    return isinstance(parsed_urls, list) and any(isinstance(url, str) and url.startswith("http") for url in parsed_urls)
 
 # Function to search related books
-def search_related_products(product_name: str) -> List[Dict]:
-    prompt = f"""Search Amazon for books related to '{product_name}'. Return a JSON list of up to 10 book URLs in this exact format: 
-    ["url1", "url2", ...]. 
-    Only include books, no other product types. Ensure the response is valid JSON. If no books are found, return an empty JSON list []."""
-    st.write(f"Debug: Sending prompt to OpenRouter: {prompt}")
+async def search_related_products(client: httpx.AsyncClient, product_name: str, model: str = SEARCH_MODEL) -> List[Dict]:
+    st.write(f"Debug: Sending topic to OpenRouter: {product_name}")
     
-    response = get_openrouter_response(prompt)
+    response = await get_openrouter_response(client, SEARCH_PROMPT, product_name, model=model, semantic=True, validate=_has_book_urls)
     if response is None:
         st.error("No response from OpenRouter")
         return []
@@ -52,18 +211,18 @@ def search_related_products(product_name: str) -> List[Dict]:
         return []
     
     try:
-        parsed_urls = json.loads(response)
+        parsed_urls = orjson.loads(response)
         if isinstance(parsed_urls, list):
             st.write(f"Debug: Successfully parsed URLs: {parsed_urls}")
             return [{"url": url} for url in parsed_urls[:10] if isinstance(url, str) and url.startswith("http")]
         else:
             st.write("Debug: Response is not a valid list")
             return []
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         st.error(f"Error parsing API response as JSON: {str(e)}")
         st.write("Debug: Attempting to extract URLs from plain text as fallback")
         # Fallback: Extract URLs from plain text
-        urls = re.findall(r'https?://[^\s"]+', response)
+        urls = _URL_RE.findall(response)
         if urls:
             st.write(f"Debug: Extracted URLs from text: {urls}")
             return [{"url": url} for url in urls[:10]]
@@ -74,41 +233,243 @@ def search_related_products(product_name: str) -> List[Dict]:
         st.error(f"Unexpected error: {str(e)}")
         return []
 
-# Function to get book details
-def get_product_details(urls: List[str]) -> List[Dict]:
-    prompt = f"""Get detailed information for these Amazon book URLs including price, description, author, publisher, and ISBN:
-    {json.dumps(urls)}
-    Support up to 50 book URLs and return as JSON. Only process URLs that correspond to books."""
+# Check that a reply decodes as BookData with at least one detail or review, so
+# invalid or empty replies (e.g. "{}") are not cached
+def _is_book_data(response: str) -> bool:
+    try:
+        book_data = msgspec.json.decode(response, type=BookData)
+    except msgspec.DecodeError:
+        return False
+    return bool(book_data.details or book_data.reviews)
+
+# Combine per-URL book data into detail and review rows
+def _merge_book_data(items: List[BookData]) -> Tuple[List[Dict], List[Dict]]:
+    book_details = [detail for item in items for detail in item.details][:50]
+    reviews = [review for item in items for review in item.reviews][:50]
+    return msgspec.to_builtins(book_details), msgspec.to_builtins(reviews)
+
+# Function to get book details and reviews, one small request per URL
+async def get_details_and_reviews(client: httpx.AsyncClient, urls: List[str]) -> Tuple[List[Dict], List[Dict]]:
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
     
-    response = get_openrouter_response(prompt)
-    if response:
-        try:
-            return json.loads(response)[:50]
-        except:
-            return []
-    return []
+    async def get_book_data(url: str) -> Optional[BookData]:
+        prompt = orjson.dumps([url]).decode()
+        async with semaphore:
+            response = await get_openrouter_response(client, BOOK_DATA_PROMPT, prompt, validate=_is_book_data)
+            if not response:
+                return None
+            try:
+                return msgspec.json.decode(response, type=BookData)
+            except msgspec.DecodeError as e:
+                # Send the invalid reply back with the error for one self-correcting pass
+                followup = [
+                    {"role": "assistant", "content": response},
+                    {"role": "user", "content": RETRY_PROMPT.format(error=e)}
+                ]
+                response = await get_openrouter_response(client, BOOK_DATA_PROMPT, prompt, validate=_is_book_data, followup=followup)
+            if not response:
+                return None
+            try:
+                return msgspec.json.decode(response, type=BookData)
+            except msgspec.DecodeError:
+                return None
+    
+    results = await asyncio.gather(*[get_book_data(url) for url in urls], return_exceptions=True)
+    for url, result in zip(urls, results):
+        if isinstance(result, BaseException):
+            logger.warning("Book data request for %s failed", url, exc_info=result)
+        elif result is None:
+            logger.warning("No usable book data returned for %s", url)
+    return _merge_book_data([r for r in results if isinstance(r, BookData)])
 
-# Function to get book reviews
-def get_product_reviews(urls: List[str]) -> List[Dict]:
-    prompt = f"""Retrieve detailed customer reviews and ratings for these Amazon book URLs:
-    {json.dumps(urls)}
-    Support up to 50 book URLs and return as JSON with review text and rating. Only process URLs that correspond to books."""
+# Submit one request per URL through the Batch API and wait for the results.
+# Returns None when the batch endpoint is missing, fails or times out.
+async def get_details_and_reviews_batch(client: httpx.AsyncClient, urls: List[str]) -> Optional[Tuple[List[Dict], List[Dict]]]:
+    response_cache = get_response_cache()
     
-    response = get_openrouter_response(prompt)
-    if response:
+    # Serve URLs already answered by an earlier run from the cache
+    cached = await asyncio.gather(*[
+        asyncio.to_thread(response_cache.get, cache_key(DEFAULT_MODEL, BOOK_DATA_PROMPT + orjson.dumps([url]).decode()))
+        for url in urls
+    ])
+    results = {url: response for url, response in zip(urls, cached) if response is not None}
+    
+    pending = [url for url in urls if url not in results]
+    if pending:
+        lines = [
+            orjson.dumps({
+                "custom_id": url,
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {"model": DEFAULT_MODEL, "messages": build_messages(BOOK_DATA_PROMPT, orjson.dumps([url]).decode()), "temperature": 0}
+            })
+            for url in pending
+        ]
+        
         try:
-            return json.loads(response)[:50]
-        except:
-            return []
-    return []
+            response = await client.post(
+                f"{OPENROUTER_API_URL}/files",
+                headers=_AUTH_HEADERS,
+                data={"purpose": "batch"},
+                files={"file": ("batch.jsonl", b"\n".join(lines), "application/jsonl")}
+            )
+            response.raise_for_status()
+            response = await client.post(
+                f"{OPENROUTER_API_URL}/batches",
+                headers=_AUTH_HEADERS,
+                json={
+                    "input_file_id": response.json()["id"],
+                    "endpoint": "/v1/chat/completions",
+                    "completion_window": "24h"
+                }
+            )
+            response.raise_for_status()
+            batch = response.json()
+            
+            deadline = time.monotonic() + BATCH_MAX_WAIT
+            with st.status("Waiting for batch to complete...") as status:
+                while batch["status"] not in ("completed", "failed", "expired", "cancelled"):
+                    if time.monotonic() > deadline:
+                        # Don't hold the script for the whole completion window
+                        await client.post(f"{OPENROUTER_API_URL}/batches/{batch['id']}/cancel", headers=_AUTH_HEADERS)
+                        status.update(label="Batch timed out", state="error")
+                        return None
+                    await asyncio.sleep(BATCH_POLL_INTERVAL)
+                    response = await client.get(f"{OPENROUTER_API_URL}/batches/{batch['id']}", headers=_AUTH_HEADERS)
+                    response.raise_for_status()
+                    batch = response.json()
+                    status.update(label=f"Batch {batch['status']}...")
+                
+                if batch["status"] != "completed":
+                    status.update(label=f"Batch {batch['status']}", state="error")
+                    return None
+                status.update(label="Batch completed", state="complete")
+            
+            response = await client.get(f"{OPENROUTER_API_URL}/files/{batch['output_file_id']}/content", headers=_AUTH_HEADERS)
+            response.raise_for_status()
+            
+            for line in response.text.splitlines():
+                if not line.strip():
+                    continue
+                result = orjson.loads(line)
+                try:
+                    content = result["response"]["body"]["choices"][0]["message"]["content"]
+                except (KeyError, IndexError, TypeError):
+                    continue
+                results[result["custom_id"]] = content
+                if _is_book_data(content):
+                    await asyncio.to_thread(response_cache.put, cache_key(DEFAULT_MODEL, BOOK_DATA_PROMPT + orjson.dumps([result["custom_id"]]).decode()), content)
+        except (httpx.HTTPError, KeyError, ValueError) as e:
+            # Network errors, missing endpoints and unexpected response bodies
+            # all fall back to live requests
+            if not (isinstance(e, httpx.HTTPStatusError) and e.response.status_code == 404):
+                st.warning(f"Error running batch on OpenRouter: {str(e)}")
+            return None
+    
+    book_data = []
+    for url in urls:
+        try:
+            book_data.append(msgspec.json.decode(results[url], type=BookData))
+        except (KeyError, msgspec.DecodeError):
+            continue
+    return _merge_book_data(book_data)
 
-# Function to generate book recommendations
-def generate_recommendations(product_data: List[Dict]) -> str:
-    prompt = f"""Based on this book data:
-    {json.dumps(product_data)}
-    Generate recommendations for book title, features (like genre, length, or target audience), and price."""
+# Function to generate book recommendations, streamed token by token
+def stream_recommendations(product_data: List[Dict], model: str = RECOMMENDATIONS_MODEL) -> Iterator[str]:
+    prompt = orjson.dumps(product_data).decode()
+    payload = {"model": model, "messages": build_messages(RECOMMENDATIONS_PROMPT, prompt), "temperature": 0, "stream": True}
     
-    return get_openrouter_response(prompt)
+    response_cache = get_response_cache()
+    key = cache_key(model, RECOMMENDATIONS_PROMPT + prompt)
+    cached = response_cache.get(key)
+    if cached is not None:
+        yield cached
+        return
+    
+    chunks = []
+    try:
+        with _get_session().stream("POST", _URL, headers=_HEADERS, content=orjson.dumps(payload)) as response:
+            response.raise_for_status()
+            for line in response.iter_lines():
+                # Server-sent events; OpenRouter also sends ": comment" keep-alives
+                if not line.startswith("data: "):
+                    continue
+                data = line[len("data: "):]
+                if data == "[DONE]":
+                    break
+                choices = orjson.loads(data).get("choices")
+                if not choices:
+                    continue
+                content = choices[0].get("delta", {}).get("content")
+                if content:
+                    chunks.append(content)
+                    yield content
+    except Exception as e:
+        st.error(f"Error connecting to OpenRouter: {str(e)}")
+        return
+    
+    if chunks:
+        response_cache.put(key, "".join(chunks))
+
+# Strip query strings and fragments, which on Amazon are tracking parameters
+def _canonical(url: str) -> str:
+    parts = urlsplit(url)
+    return urlunsplit((parts.scheme, parts.netloc, parts.path.rstrip("/"), "", ""))
+
+# Run the analysis pipeline, sharing one HTTP/2 client across all requests
+async def run_analyze(product_name: str, use_batch: bool = False, model_search: str = SEARCH_MODEL):
+    # An AsyncClient is bound to the event loop it first runs on, and each
+    # rerun starts a new loop, so this one lives for a single analysis
+    async with httpx.AsyncClient(http2=True, timeout=60) as client:
+        # Step 1: Search related books
+        related_books = await search_related_products(client, product_name, model_search)
+        if not related_books:
+            return [], [], []
+            
+        # Drop duplicate URLs so each book is only sent to the model once
+        urls = list(dict.fromkeys(_canonical(book["url"]) for book in related_books))
+        
+        # Steps 2 and 3: Get book details and reviews
+        batch_results = await get_details_and_reviews_batch(client, urls) if use_batch else None
+        if batch_results is None:
+            if use_batch:
+                st.info("Batch API unavailable, falling back to live requests")
+            batch_results = await get_details_and_reviews(client, urls)
+        book_details, reviews = batch_results
+        
+        return related_books, book_details, reviews
+
+# Raised by analyze for empty or failed runs; st.cache_data does not store
+# exceptions, so the next attempt calls OpenRouter again
+class AnalysisError(Exception):
+    pass
+
+# Cache the analysis so reruns for the same topic don't call OpenRouter again.
+# Recommendations are streamed separately and served from the response cache.
+@st.cache_data(ttl=3600, show_spinner="Analyzing books...")
+def analyze(product_name: str, use_batch: bool = False, model_search: str = SEARCH_MODEL) -> Tuple[List[Dict], List[Dict], List[Dict]]:
+    related_books, book_details, reviews = asyncio.run(run_analyze(product_name, use_batch, model_search))
+    if not related_books:
+        raise AnalysisError("No related books found")
+    if not book_details and not reviews:
+        raise AnalysisError("No book details or reviews could be retrieved")
+    return related_books, book_details, reviews
+
+# Build an all-string Arrow table whose columns are the fields of struct_type.
+# Not cached: hashing the rows would cost about as much as building the table.
+def to_arrow_table(rows: List[Dict], struct_type: type) -> pa.Table:
+    columns = [field.name for field in msgspec.structs.fields(struct_type)]
+    schema = pa.schema([(column, pa.string()) for column in columns])
+    rows = [
+        {
+            column: None if row.get(column) is None
+            else row[column] if isinstance(row[column], str)
+            else orjson.dumps(row[column]).decode()
+            for column in columns
+        }
+        for row in rows
+    ]
+    return pa.Table.from_pylist(rows, schema=schema)
 
 # Main Streamlit app
 def main():
@@ -118,54 +479,55 @@ def main():
     with st.sidebar:
         st.header("Settings")
         product_name = st.text_input("Enter a book title or topic")
+        use_batch = st.checkbox("Use Batch API (cheaper, slower)")
+        model_search = st.text_input("Search model", SEARCH_MODEL)
+        model_recs = st.text_input("Recommendations model", RECOMMENDATIONS_MODEL)
         analyze_button = st.button("Analyze Books")
     
     # Main content
+    # Settings are captured when the button is clicked, so later sidebar edits
+    # don't start a new (paid) analysis until Analyze is pressed again
     if analyze_button and product_name:
-        with st.spinner("Analyzing books..."):
-            # Step 1: Search related books
-            related_books = search_related_products(product_name)
-            if not related_books:
-                st.error("No related books found")
-                return
-                
-            urls = [book["url"] for book in related_books]
-            
-            # Step 2: Get book details
-            book_details = get_product_details(urls)
-            
-            # Step 3: Get reviews
-            reviews = get_product_reviews(urls)
-            
-            # Step 4: Generate recommendations
-            recommendations = generate_recommendations(book_details)
-            
-            # Display results
-            tab1, tab2, tab3, tab4 = st.tabs(["Related Books", "Book Details", "Reviews", "Recommendations"])
+        st.session_state["analysis"] = (product_name, use_batch, model_search, model_recs)
+    
+    # Keep showing the last analysis on later reruns (tab switches, sidebar changes)
+    if "analysis" in st.session_state:
+        product_name, use_batch, model_search, model_recs = st.session_state["analysis"]
+        try:
+            related_books, book_details, reviews = analyze(product_name, use_batch, model_search)
+        except AnalysisError as e:
+            # Failures aren't cached, so forget the request instead of retrying it on every rerun
+            del st.session_state["analysis"]
+            st.error(str(e))
+            return
+        
+        # Display results
+        tab1, tab2, tab3, tab4 = st.tabs(["Related Books", "Book Details", "Reviews", "Recommendations"])
+        
+        with tab1:
+            st.subheader("Related Books")
+            st.json(related_books)
             
-            with tab1:
-                st.subheader("Related Books")
-                st.json(related_books)
+        with tab2:
+            st.subheader("Book Details")
+            if book_details:
+                st.dataframe(to_arrow_table(book_details, BookDetail))
+            else:
+                st.write("No book details available")
+                
+        with tab3:
+            st.subheader("Customer Reviews")
+            if reviews:
+                st.dataframe(to_arrow_table(reviews, Review))
+            else:
+                st.write("No reviews available")
                 
-            with tab2:
-                st.subheader("Book Details")
-                if book_details:
-                    df_details = pd.DataFrame(book_details)
-                    st.dataframe(df_details)
-                else:
-                    st.write("No book details available")
-                    
-            with tab3:
-                st.subheader("Customer Reviews")
-                if reviews:
-                    df_reviews = pd.DataFrame(reviews)
-                    st.dataframe(df_reviews)
-                else:
-                    st.write("No reviews available")
-                    
-            with tab4:
-                st.subheader("Book Recommendations")
-                st.write(recommendations if recommendations else "No recommendations generated")
+        with tab4:
+            st.subheader("Book Recommendations")
+            # Step 4: Generate recommendations
+            recommendations = st.write_stream(stream_recommendations(book_details, model_recs))
+            if not recommendations:
+                st.write("No recommendations generated")
 
 if __name__ == "__main__":
     # Check if API key is set in secrets
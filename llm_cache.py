@@ -0,0 +1,173 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:
+    faiss = None
+
+logger = logging.getLogger(__name__)
+
+def cache_key(model: str, prompt: str) -> str:
+    return hashlib.sha256(f"{model}|{prompt}".encode("utf-8")).hexdigest()
+
+# Exact-match response cache, shared across sessions through Redis when a client
+# is given and kept in process memory otherwise. Redis errors are treated as
+# misses, so an unavailable Redis only costs the cache, not the request.
+class ResponseCache:
+    def __init__(self, redis_client=None, ttl: int = 3600, max_entries: int = 1024):
+        self.redis = redis_client
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._memory = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        if self.redis is not None:
+            try:
+                value = self.redis.get(key)
+            except Exception:
+                logger.warning("Redis GET failed, treating as a cache miss", exc_info=True)
+                return None
+            return value.decode("utf-8") if value is not None else None
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is None:
+                return None
+            if time.time() > entry[1]:
+                del self._memory[key]
+                return None
+            return entry[0]
+
+    def put(self, key: str, response: str):
+        if self.redis is not None:
+            try:
+                self.redis.setex(key, self.ttl, response)
+            except Exception:
+                logger.warning("Redis SETEX failed, response not cached", exc_info=True)
+            return
+        with self._lock:
+            now = time.time()
+            self._memory.pop(key, None)
+            if len(self._memory) >= self.max_entries:
+                # Sweep expired entries, then drop the oldest if still full
+                self._memory = {k: v for k, v in self._memory.items() if v[1] > now}
+                while len(self._memory) >= self.max_entries:
+                    del self._memory[next(iter(self._memory))]
+            self._memory[key] = (response, now + self.ttl)
+
+# Semantic cache for LLM responses: prompts are embedded and stored in FAISS
+# inner-product indexes, with the prompt/response text kept in a parallel SQLite
+# table. Each namespace (e.g. a model name) has its own index and exact keys,
+# so a lookup only ever matches responses from the same namespace.
+class SemanticCache:
+    def __init__(self, path: str, encoder, threshold: float = 0.92, ttl: Optional[int] = None):
+        if faiss is None:
+            raise ImportError("SemanticCache requires faiss")
+        self.encoder = encoder
+        self.threshold = threshold
+        self.ttl = ttl
+        self.path = path
+        self._indexes = {}
+        self._lock = threading.Lock()
+
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(f"{path}.sqlite", check_same_thread=False)
+        self.db.execute(
+            """CREATE TABLE IF NOT EXISTS entries (
+                id INTEGER PRIMARY KEY,
+                key TEXT UNIQUE,
+                prompt TEXT,
+                response TEXT,
+                ts INTEGER
+            )"""
+        )
+        self.db.commit()
+
+    @staticmethod
+    def cache_key(prompt: str, namespace: str = "") -> str:
+        return hashlib.sha256(f"{namespace}|{prompt}".encode("utf-8")).hexdigest()
+
+    def _index_path(self, namespace: str) -> str:
+        return f"{self.path}-{hashlib.sha256(namespace.encode('utf-8')).hexdigest()[:16]}.faiss"
+
+    def _index(self, namespace: str):
+        if namespace not in self._indexes:
+            index_path = self._index_path(namespace)
+            if os.path.exists(index_path):
+                self._indexes[namespace] = faiss.read_index(index_path)
+            else:
+                dim = self.encoder.get_sentence_embedding_dimension()
+                # Wrap the flat index so FAISS ids match the SQLite row ids
+                self._indexes[namespace] = faiss.IndexIDMap(faiss.IndexFlatIP(dim))
+        return self._indexes[namespace]
+
+    def _embed(self, prompt: str) -> np.ndarray:
+        # Normalized embeddings make inner product equal to cosine similarity
+        vector = self.encoder.encode([prompt], normalize_embeddings=True)
+        return np.asarray(vector, dtype="float32")
+
+    def _is_expired(self, ts: int) -> bool:
+        return self.ttl is not None and time.time() - ts > self.ttl
+
+    def _evict(self, entry_id: int, namespace: str):
+        index = self._index(namespace)
+        index.remove_ids(np.array([entry_id], dtype="int64"))
+        self.db.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+        self.db.commit()
+        faiss.write_index(index, self._index_path(namespace))
+
+    def get(self, prompt: str, namespace: str = "") -> Optional[str]:
+        with self._lock:
+            # Exact match first, then the nearest neighbour
+            row = self.db.execute(
+                "SELECT id, response, ts FROM entries WHERE key = ?", (self.cache_key(prompt, namespace),)
+            ).fetchone()
+            if row:
+                if not self._is_expired(row[2]):
+                    return row[1]
+                self._evict(row[0], namespace)
+
+            index = self._index(namespace)
+            if index.ntotal == 0:
+                return None
+
+            scores, ids = index.search(self._embed(prompt), 1)
+            if ids[0][0] == -1 or scores[0][0] < self.threshold:
+                return None
+
+            row = self.db.execute(
+                "SELECT id, response, ts FROM entries WHERE id = ?", (int(ids[0][0]),)
+            ).fetchone()
+            if row is None:
+                return None
+            if self._is_expired(row[2]):
+                self._evict(row[0], namespace)
+                return None
+            return row[1]
+
+    def put(self, prompt: str, response: str, namespace: str = ""):
+        key = self.cache_key(prompt, namespace)
+        with self._lock:
+            index = self._index(namespace)
+            # A replaced row gets a new id, so drop the vector stored for the old one
+            old = self.db.execute("SELECT id FROM entries WHERE key = ?", (key,)).fetchone()
+            if old:
+                index.remove_ids(np.array([old[0]], dtype="int64"))
+
+            cursor = self.db.execute(
+                "INSERT OR REPLACE INTO entries (key, prompt, response, ts) VALUES (?, ?, ?, ?)",
+                (key, prompt, response, int(time.time())),
+            )
+            self.db.commit()
+
+            entry_id = np.array([cursor.lastrowid], dtype="int64")
+            index.add_with_ids(self._embed(prompt), entry_id)
+            faiss.write_index(index, self._index_path(namespace))